@@ -0,0 +1,95 @@
+#sparse term x word co-occurrence counts of all target terms in one pass over the tokens
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+
+# Words at each distance from the target terms
+# Every tweet belongs to one target term, its words at distance d (on either side) of an
+# occurrence of that term are counted in counts[d], including the term itself at distance 0.
+# Rows are the target terms, columns the vocabulary of the token table.
+def offset_counts(table, tweet_terms, terms, max_window):
+    words = table["words"]
+    offsets = table["offsets"]
+    shape = (len(terms), len(table["vocab"]))
+
+    lengths = np.diff(offsets)
+    tweet_of_token = np.repeat(np.arange(len(lengths)), lengths)
+    term_rows = pd.Index(terms).get_indexer(pd.Series(tweet_terms, dtype=object))
+    term_codes = pd.Index(table["vocab"]).get_indexer(terms)
+
+    # Occurrences of the term of the tweet
+    # Tweets of other terms get row -1, which maps to the code -1 that matches no word
+    token_rows = term_rows[tweet_of_token]
+    targets = np.append(term_codes, -1)[token_rows]
+    hits = np.flatnonzero((targets >= 0) & (words == targets))
+    hit_rows = token_rows[hits]
+    starts = offsets[tweet_of_token[hits]]
+    ends = offsets[tweet_of_token[hits] + 1]
+
+    counts = []
+    for distance in range(max_window + 1):
+        rows, cols = [], []
+        positions = (hits,) if distance == 0 else (hits - distance, hits + distance)
+        for position in positions:
+            valid = (position >= starts) & (position < ends)
+            rows.append(hit_rows[valid])
+            cols.append(words[position[valid]])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        counts.append(coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=shape).tocsr())
+    return counts
+
+# Counts within a window of window_size words on each side
+# Returns the co-occurrences without the term itself and the counts of all words in the windows
+def window_counts(counts, terms, vocab, window_size):
+    context_counts = counts[0].copy()
+    for distance in range(1, window_size + 1):
+        context_counts = context_counts + counts[distance]
+
+    # Drop the column of each row's own term
+    context = context_counts.tocoo()
+    term_codes = pd.Index(vocab).get_indexer(terms)
+    own_term = context.col == term_codes[context.row]
+    co_occurrences = coo_matrix(
+        (context.data[~own_term], (context.row[~own_term], context.col[~own_term])), shape=context.shape
+    ).tocsr()
+    return co_occurrences, context_counts
+
+# Co-occurrence matrices of all terms for every window size
+def windows_from_counts(counts, terms, vocab, window_sizes):
+    return {window_size: window_counts(counts, terms, vocab, window_size) for window_size in window_sizes}
+
+def co_occurrence_counts(table, tweet_terms, terms, window_sizes):
+    counts = offset_counts(table, tweet_terms, terms, max(window_sizes))
+    return windows_from_counts(counts, terms, table["vocab"], window_sizes)
+
+# Partial counts of a shard of tweets
+# Only the words that occur in the counts are kept, so shards with different vocabularies can be merged
+def compact_counts(counts, vocab):
+    used = np.unique(np.concatenate([distance_counts.indices for distance_counts in counts]))
+    columns = np.full(len(vocab), -1, dtype=np.int64)
+    columns[used] = np.arange(len(used))
+
+    compact = []
+    for distance_counts in counts:
+        distance_counts = distance_counts.tocoo()
+        compact.append(coo_matrix(
+            (distance_counts.data, (distance_counts.row, columns[distance_counts.col])), shape=(distance_counts.shape[0], len(used))
+        ).tocsr())
+    return [vocab[code] for code in used], compact
+
+# Sum the partial counts of all shards over the union of their words
+def merge_counts(partials, n_terms, max_window):
+    vocab = {}
+    shard_codes = [np.array([vocab.setdefault(word, len(vocab)) for word in words], dtype=np.int64) for words, counts in partials]
+
+    merged = []
+    for distance in range(max_window + 1):
+        distance_counts = csr_matrix((n_terms, len(vocab)), dtype=np.int64)
+        for codes, (words, counts) in zip(shard_codes, partials):
+            shard_counts = counts[distance].tocoo()
+            distance_counts = distance_counts + coo_matrix(
+                (shard_counts.data, (shard_counts.row, codes[shard_counts.col])), shape=(n_terms, len(vocab))
+            ).tocsr()
+        merged.append(distance_counts)
+    return list(vocab), merged
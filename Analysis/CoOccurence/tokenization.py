@@ -0,0 +1,196 @@
+#shared spaCy tokenization for the co-occurrence scripts
+#the model is loaded once per process without the components the analysis doesn't use
+#tagged tweets are cached on disk by a hash of their text, so spaCy only runs for texts it hasn't seen
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import spacy
+
+MODEL_NAME = "es_core_news_sm"
+
+# Parsing, entities and lemmas are not used, POS tags come from the morphologizer and attribute ruler
+EXCLUDED_COMPONENTS = ["parser", "senter", "ner", "lemmatizer"]
+
+# Content words kept for the log likelihood analysis
+CONTENT_POS = {"NOUN", "VERB", "ADJ"}
+EXCLUDED_PREFIXES = ("http", "@")
+
+BATCH_SIZE = 1000
+
+cache_folder = "cache"
+
+_nlp = None
+
+def load_nlp():
+    global _nlp
+    if _nlp is None:
+        _nlp = spacy.load(MODEL_NAME, exclude=EXCLUDED_COMPONENTS)
+    return _nlp
+
+# Version of the installed model, read from the package metadata without loading the model
+def model_version():
+    return f"{MODEL_NAME}-{spacy.util.get_package_version(MODEL_NAME)}"
+
+def cache_path():
+    return os.path.join(cache_folder, f"tokens_by_text_{model_version()}.npz")
+
+# Key of a tweet in the token table
+# Tweets are tagged lowercased, so all texts that are equal in lowercase share their tokens. Ids of the
+# database are not used, a tweet matching several terms has several ids and ids are reused after filtering again.
+def text_keys(texts):
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(text.lower().encode(), digest_size=8).digest(), "little", signed=True) for text in texts],
+        dtype=np.int64,
+    )
+
+# Token table
+# The alphabetic tokens of all tweets are stored as integer codes into a vocabulary, with their POS
+# tags coded the same way. Tweet i owns the tokens offsets[i] to offsets[i + 1], tweets are sorted by key.
+def empty_token_table():
+    return {
+        "keys": np.zeros(0, dtype=np.int64),
+        "offsets": np.zeros(1, dtype=np.int64),
+        "words": np.zeros(0, dtype=np.int32),
+        "pos": np.zeros(0, dtype=np.int8),
+        "vocab": [],
+        "pos_tags": [],
+    }
+
+# Tag tweets with spaCy, tweets are processed in batches and with n_process > 1 in several processes
+# The texts should be distinct, every text gets its own entry
+def tag_tweets(texts, batch_size=BATCH_SIZE, n_process=1):
+    texts = list(texts)
+    nlp = load_nlp()
+    vocab, pos_tags = {}, {}
+    words, pos, lengths = [], [], []
+
+    for doc in nlp.pipe((text.lower() for text in texts), batch_size=batch_size, n_process=n_process):
+        tokens = [token for token in doc if token.is_alpha]
+        words.extend(vocab.setdefault(token.text, len(vocab)) for token in tokens)
+        pos.extend(pos_tags.setdefault(token.pos_, len(pos_tags)) for token in tokens)
+        lengths.append(len(tokens))
+
+    keys = text_keys(texts)
+    order = np.argsort(keys, kind="stable")
+    table = {
+        "keys": keys,
+        "offsets": np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+        "words": np.array(words, dtype=np.int32),
+        "pos": np.array(pos, dtype=np.int8),
+        "vocab": list(vocab),
+        "pos_tags": list(pos_tags),
+    }
+    return take_tweets(table, keys[order], positions=order)
+
+# Tokens of the given tweets, in the order of keys. Positions of the tweets in the table can be
+# passed directly, otherwise they are looked up by key.
+def take_tweets(table, keys, positions=None):
+    if positions is None:
+        positions = np.searchsorted(table["keys"], keys)
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = table["offsets"][positions]
+    lengths = table["offsets"][positions + 1] - starts
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    tokens = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return dict(
+        table,
+        keys=np.asarray(keys, dtype=np.int64),
+        offsets=offsets,
+        words=table["words"][tokens],
+        pos=table["pos"][tokens],
+    )
+
+# Add the tweets of table b to table a, codes of a stay the same
+# Tweets of b that are already in a are skipped
+def merge_token_tables(a, b):
+    new = np.flatnonzero(~np.isin(b["keys"], a["keys"]))
+    b = take_tweets(b, b["keys"][new], positions=new)
+    known_words, known_tags = set(a["vocab"]), set(a["pos_tags"])
+    vocab = a["vocab"] + [word for word in b["vocab"] if word not in known_words]
+    pos_tags = a["pos_tags"] + [tag for tag in b["pos_tags"] if tag not in known_tags]
+    b_words = pd.Index(vocab).get_indexer(b["vocab"])[b["words"]]
+    b_pos = pd.Index(pos_tags).get_indexer(b["pos_tags"])[b["pos"]]
+
+    merged = {
+        "keys": np.concatenate([a["keys"], b["keys"]]),
+        "offsets": np.concatenate([a["offsets"], a["offsets"][-1] + b["offsets"][1:]]),
+        "words": np.concatenate([a["words"], b_words]).astype(np.int32),
+        "pos": np.concatenate([a["pos"], b_pos]).astype(np.int8),
+        "vocab": vocab,
+        "pos_tags": pos_tags,
+    }
+    order = np.argsort(merged["keys"], kind="stable")
+    return take_tweets(merged, merged["keys"][order], positions=order)
+
+# Strings as their concatenated UTF-8 bytes and the byte offsets of each string
+# A fixed-width string array would pad every word to the length of the longest one
+def encode_strings(strings):
+    encoded = [string.encode() for string in strings]
+    offsets = np.concatenate([[0], np.cumsum([len(string) for string in encoded], dtype=np.int64)])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def decode_strings(data, offsets):
+    data = data.tobytes()
+    return [data[start:end].decode() for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+# Save and load the token table as one .npz file
+def save_token_table(table, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    vocab, vocab_offsets = encode_strings(table["vocab"])
+    pos_tags, pos_tag_offsets = encode_strings(table["pos_tags"])
+    np.savez(
+        path,
+        keys=table["keys"],
+        offsets=table["offsets"],
+        words=table["words"],
+        pos=table["pos"],
+        vocab=vocab,
+        vocab_offsets=vocab_offsets,
+        pos_tags=pos_tags,
+        pos_tag_offsets=pos_tag_offsets,
+    )
+
+def load_token_table(path):
+    if not os.path.exists(path):
+        return empty_token_table()
+    with np.load(path) as arrays:
+        table = {name: arrays[name] for name in ("keys", "offsets", "words", "pos")}
+        table["vocab"] = decode_strings(arrays["vocab"], arrays["vocab_offsets"])
+        table["pos_tags"] = decode_strings(arrays["pos_tags"], arrays["pos_tag_offsets"])
+    return table
+
+# Tokens of the tweets from a token table, tweets missing there are tagged once per distinct text
+# Returns the tokens in the order of texts and the table of the newly tagged tweets
+def lookup_tokens(table, texts, batch_size=BATCH_SIZE, n_process=1):
+    tweets = pd.DataFrame({"text": pd.Series(list(texts), dtype=object).fillna("")})
+    tweets["key"] = text_keys(tweets["text"])
+    known = np.isin(tweets["key"], table["keys"])
+    missing = tweets[~known].drop_duplicates("key")
+
+    tagged = empty_token_table()
+    if not missing.empty:
+        print(f"Tagging {len(missing)} tweets that are not in the token cache...")
+        tagged = tag_tweets(missing["text"], batch_size, n_process)
+
+    known_table = take_tweets(table, np.unique(tweets.loc[known, "key"]))
+    return take_tweets(merge_token_tables(known_table, tagged), tweets["key"].to_numpy()), tagged
+
+# Tokens of the tweets, from the cache where possible
+# Only tweets missing in the cache are tagged, they are added to the cache for later runs
+def cached_tokens(texts, batch_size=BATCH_SIZE, n_process=1, path=None):
+    path = path or cache_path()
+    table = load_token_table(path)
+    tokens, tagged = lookup_tokens(table, texts, batch_size, n_process)
+    if len(tagged["keys"]):
+        save_token_table(merge_token_tables(table, tagged), path)
+    return tokens
+
+# Only the content words of the analysis
+def content_words(table):
+    pos_mask = np.array([tag in CONTENT_POS for tag in table["pos_tags"]], dtype=bool)
+    word_mask = np.array([not word.startswith(EXCLUDED_PREFIXES) for word in table["vocab"]], dtype=bool)
+    keep = pos_mask[table["pos"]] & word_mask[table["words"]]
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    return dict(table, offsets=kept_before[table["offsets"]], words=table["words"][keep], pos=table["pos"][keep])
@@ -2,9 +2,10 @@
 
 import pandas as pd
 import numpy as np
-from scipy.stats import chi2_contingency
+from scipy.stats import chi2_contingency, chi2 as chi2_distribution
 from sqlalchemy import create_engine
 import plotly.express as px
+from temporal_cube import load_cube, term_day_counts, all_day_counts
 
 # DB
 def connect_to_db():
@@ -15,42 +16,46 @@ def connect_to_db():
         print(f"Database connection failed: {e}")
         return None
 
+# Chi-Square test of every term against its expected counts
+# Each row is tested as the 2 x days table [observed, expected] like chi2_contingency does,
+# but for all terms at once. Yates' correction is only applied with one degree of freedom.
+def term_chi2_tests(observed, expected, correction=True):
+    tables = np.stack([np.asarray(observed, dtype=float), np.asarray(expected, dtype=float)], axis=1)
+    row_sums = tables.sum(axis=2, keepdims=True)
+    column_sums = tables.sum(axis=1, keepdims=True)
+    table_expected = row_sums * column_sums / row_sums.sum(axis=1, keepdims=True)
+
+    dof = tables.shape[2] - 1
+    difference = tables - table_expected
+    if correction and dof == 1:
+        difference = np.sign(difference) * np.maximum(np.abs(difference) - 0.5, 0)
+    chi2_stats = (difference ** 2 / table_expected).sum(axis=(1, 2))
+    p_values = chi2_distribution.sf(chi2_stats, dof) if dof > 0 else np.ones(len(tables))
+    return chi2_stats, dof, p_values
+
 engine = connect_to_db()
 if engine is None:
     exit()
 
 # Query data
-query_all_tweets = """
-SELECT EXTRACT(DOY FROM created_at) AS day_of_year, COUNT(*) AS count
-FROM variance.labeled_tweets
-WHERE "Label" = 1
-GROUP BY EXTRACT(DOY FROM created_at);
-"""
-all_tweets_df = pd.read_sql(query_all_tweets, engine)
-
-query_terms = """
-SELECT found_term AS term, EXTRACT(DOY FROM created_at) AS day_of_year, COUNT(*) AS count
-FROM variance.labeled_tweets
-WHERE "Label" = 1 
-AND found_term IN (
-    SELECT main_term_sp 
-    FROM variance.landscape_terms
-    WHERE relevant = true
-)
-GROUP BY found_term, EXTRACT(DOY FROM created_at);
+query_relevant_terms = """
+SELECT main_term_sp AS term
+FROM variance.landscape_terms
+WHERE relevant = true;
 """
-terms_df = pd.read_sql(query_terms, engine)
+relevant_terms = pd.read_sql(query_relevant_terms, engine)["term"]
 
-engine.dispose()
+# Day-of-year counts from the shared cube, only new tweets are aggregated
+cube = load_cube(engine)
 
-# pivot data
-daily_counts = terms_df.pivot(index='term', columns='day_of_year', values='count').fillna(0)
+engine.dispose()
 
-# All days
+# Terms by day, all days
+daily_counts = term_day_counts(cube, relevant_terms)
 daily_counts = daily_counts.reindex(columns=range(1, 366), fill_value=0)
 
-# Pivot data
-all_tweets_daily = all_tweets_df.set_index("day_of_year").reindex(range(1, 366), fill_value=0)["count"]
+# All tweets by day
+all_tweets_daily = all_day_counts(cube).reindex(range(1, 366), fill_value=0)
 
 # Remove 0
 observed = daily_counts.loc[daily_counts.sum(axis=1) > 0, daily_counts.sum(axis=0) > 0]
@@ -119,18 +124,13 @@ fig.show()
 fig.write_image("overview.png", width=1920, height=1080, scale=3)
 
 
-all_terms_pvalues = []
-
-for term in observed.index:
-    observed_term = observed.loc[term].values
-    expected_term = expected[observed.index.get_loc(term)]
-    
-    chi2_term, p_term = chi2_contingency([observed_term, expected_term])[:2]
-    
-    all_terms_pvalues.append((term, f"{p_term:.6f}"))  
+chi2_terms, dof_terms, p_terms = term_chi2_tests(observed.values, expected)
 
 # DF
-all_terms_pvalues_df = pd.DataFrame(all_terms_pvalues, columns=["Term", "P-Value"])
+all_terms_pvalues_df = pd.DataFrame({
+    "Term": observed.index,
+    "P-Value": [f"{p_term:.6f}" for p_term in p_terms],
+})
 
 # Sort terms by p-value
 all_terms_pvalues_df = all_terms_pvalues_df.sort_values(by="P-Value", key=lambda x: x.astype(float))
@@ -6,6 +6,7 @@ import numpy as np
 from scipy.stats import chi2_contingency
 from sqlalchemy import create_engine
 import plotly.express as px
+from temporal_cube import load_cube, term_day_counts, all_day_counts
 
 # DB
 def connect_to_db():
@@ -16,34 +17,23 @@ def connect_to_db():
         print(f"Database connection failed: {e}")
         return None
 
-def plot_term_residuals(term):
-    engine = connect_to_db()
-    if engine is None:
-        exit()
-
-    # Query data
-    query_term = f"""
-    SELECT EXTRACT(DOY FROM created_at) AS day_of_year, COUNT(*) AS count
-    FROM variance.labeled_tweets
-    WHERE "Label" = 1 AND found_term = '{term}'
-    GROUP BY EXTRACT(DOY FROM created_at);
-    """
-    term_df = pd.read_sql(query_term, engine)
-
-    query_all_tweets = """
-    SELECT EXTRACT(DOY FROM created_at) AS day_of_year, COUNT(*) AS count
-    FROM variance.labeled_tweets
-    WHERE "Label" = 1
-    GROUP BY EXTRACT(DOY FROM created_at);
-    """
-    all_tweets_df = pd.read_sql(query_all_tweets, engine)
-
-    engine.dispose()
-
-    # DF MErge
-    merged_df = pd.merge(
-        term_df, all_tweets_df, on="day_of_year", suffixes=(f"_{term}", "_all"), how="right"
-    ).fillna(0)
+# The cube of all terms can be passed in, so several terms are plotted without querying again
+def plot_term_residuals(term, cube=None):
+    if cube is None:
+        engine = connect_to_db()
+        if engine is None:
+            exit()
+        cube = load_cube(engine)
+        engine.dispose()
+
+    # Days with tweets
+    all_tweets_daily = all_day_counts(cube)
+    term_daily = term_day_counts(cube, [term])
+    term_daily = term_daily.loc[term] if term in term_daily.index else 0
+    merged_df = pd.DataFrame({
+        f"count_{term}": term_daily,
+        "count_all": all_tweets_daily,
+    })[all_tweets_daily > 0].rename_axis("day_of_year").reset_index()
 
     observed = np.array([merged_df[f"count_{term}"], merged_df["count_all"] - merged_df[f"count_{term}"]])
 
@@ -131,6 +121,12 @@ def plot_term_residuals(term):
     print(f"Top 5 Days for '{term}':")
     print(merged_df.nlargest(5, f"count_{term}")[["day_of_year", f"count_{term}"]])
 
-plot_term_residuals("montaña") 
+engine = connect_to_db()
+if engine is None:
+    exit()
+cube = load_cube(engine)
+engine.dispose()
+
+plot_term_residuals("montaña", cube) 
 
 
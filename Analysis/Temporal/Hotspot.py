@@ -3,6 +3,7 @@
 
 import pandas as pd
 from sqlalchemy import create_engine
+from temporal_cube import load_cube, term_day_counts
 
 # DV
 def connect_to_db():
@@ -13,6 +14,13 @@ def connect_to_db():
         print(f"Database connection failed: {e}")
         return None
 
+# Days with the most tweets of a term, from the day-of-year cube
+def peak_days(cube, term, n=5):
+    term_daily = term_day_counts(cube, [term])
+    if term not in term_daily.index:
+        return pd.Series(dtype="int64", name="count")
+    return term_daily.loc[term].nlargest(n).rename("count")
+
 # Save Tweets
 def save_tweets_for_term_and_day(engine, term, day_of_year, output_file):
     query = f"""
@@ -38,7 +46,16 @@ def main():
     hotspot_day = 146       
     output_file = f"hotspot_tweets_{hotspot_term}_day_{hotspot_day}.csv"
 
-    save_tweets_for_term_and_day(engine, hotspot_term, hotspot_day, output_file)
+    # The cube tells which days have tweets without scanning the table
+    cube = load_cube(engine)
+    top_days = peak_days(cube, hotspot_term)
+    print(f"Top days for '{hotspot_term}':")
+    print(top_days)
+
+    if top_days.empty or term_day_counts(cube, [hotspot_term]).loc[hotspot_term, hotspot_day] == 0:
+        print(f"No tweets found for term '{hotspot_term}' on day {hotspot_day}.")
+    else:
+        save_tweets_for_term_and_day(engine, hotspot_term, hotspot_day, output_file)
 
     engine.dispose()
 
@@ -0,0 +1,137 @@
+# Term x year x day-of-year counts of the relevant tweets, shared by the temporal scripts
+# The cube is stored in a local .npz file, built once and afterwards only extended with new tweets
+
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+cache_folder = "cache"
+cube_path = os.path.join(cache_folder, "doy_cube.npz")
+
+# State of the relevant tweets, rows up to the last processed id are compared with the cube
+# so deleted or relabeled tweets trigger a rebuild. The checksum covers term, time and text,
+# ids start over after the tweets are filtered again and can then belong to other tweets.
+query_cube_state = """
+SELECT COUNT(*) FILTER (WHERE id <= :last_id) AS n_old,
+       COALESCE(SUM(id) FILTER (WHERE id <= :last_id), 0) AS id_sum_old,
+       COALESCE(SUM(hashtext(concat_ws('|', found_term, created_at::text, tweet_text))) FILTER (WHERE id <= :last_id), 0) AS checksum_old,
+       COUNT(*) AS n,
+       COALESCE(SUM(id), 0) AS id_sum,
+       COALESCE(SUM(hashtext(concat_ws('|', found_term, created_at::text, tweet_text))), 0) AS checksum,
+       COALESCE(MAX(id), -1) AS max_id
+FROM variance.labeled_tweets
+WHERE "Label" = 1
+  AND created_at IS NOT NULL;
+"""
+
+# Counts of the tweets added since the last refresh, tweets without a term are counted under ''
+query_cube_counts = """
+SELECT COALESCE(found_term, '') AS term,
+       EXTRACT(YEAR FROM created_at) AS year,
+       EXTRACT(DOY FROM created_at) AS day_of_year,
+       COUNT(*) AS count
+FROM variance.labeled_tweets
+WHERE "Label" = 1
+  AND created_at IS NOT NULL
+  AND id > :last_id
+  AND id <= :max_id
+GROUP BY 1, 2, 3;
+"""
+
+def empty_cube():
+    return {"terms": [], "years": [], "counts": np.zeros((0, 0, 366), dtype=np.int64), "last_id": -1, "n": 0, "id_sum": 0, "checksum": 0}
+
+# Save and load the cube
+def save_cube(cube, path=cube_path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(
+        path,
+        terms=np.array(cube["terms"], dtype=str),
+        years=np.array(cube["years"], dtype=np.int64),
+        counts=cube["counts"],
+        state=np.array([cube["last_id"], cube["n"], cube["id_sum"], cube["checksum"]], dtype=np.int64),
+    )
+
+def read_cube(path=cube_path):
+    if not os.path.exists(path):
+        return empty_cube()
+    with np.load(path) as arrays:
+        state = arrays["state"].tolist()
+        # Cubes saved before the checksum was added get none and are rebuilt
+        last_id, n, id_sum = state[:3]
+        checksum = state[3] if len(state) > 3 else None
+        return {
+            "terms": arrays["terms"].tolist(),
+            "years": arrays["years"].tolist(),
+            "counts": arrays["counts"],
+            "last_id": last_id,
+            "n": n,
+            "id_sum": id_sum,
+            "checksum": checksum,
+        }
+
+# Add aggregated counts to the cube, new terms and years get their own rows
+def add_counts(cube, counts_df):
+    terms = sorted(set(cube["terms"]) | set(counts_df["term"]))
+    years = sorted(set(cube["years"]) | set(counts_df["year"].astype(int)))
+    counts = np.zeros((len(terms), len(years), 366), dtype=np.int64)
+
+    term_index = pd.Index(terms)
+    year_index = pd.Index(years)
+    if cube["terms"]:
+        counts[np.ix_(term_index.get_indexer(cube["terms"]), year_index.get_indexer(cube["years"]))] = cube["counts"]
+    np.add.at(
+        counts,
+        (
+            term_index.get_indexer(counts_df["term"]),
+            year_index.get_indexer(counts_df["year"].astype(int)),
+            counts_df["day_of_year"].astype(int).to_numpy() - 1,
+        ),
+        counts_df["count"].astype(np.int64).to_numpy(),
+    )
+    return dict(cube, terms=terms, years=years, counts=counts)
+
+# Cube of all relevant tweets
+# Only tweets with an id above the last processed one are aggregated, the cube is rebuilt
+# from scratch when tweets up to that id have changed
+def load_cube(engine, path=cube_path):
+    cube = read_cube(path)
+    state = pd.read_sql(text(query_cube_state), engine, params={"last_id": cube["last_id"]}).iloc[0]
+
+    if (int(state["n_old"]) != cube["n"] or int(state["id_sum_old"]) != cube["id_sum"]
+            or int(state["checksum_old"]) != cube["checksum"]):
+        print("Labeled tweets have changed, rebuilding the day-of-year cube.")
+        cube = empty_cube()
+    if int(state["max_id"]) == cube["last_id"]:
+        return cube
+
+    counts_df = pd.read_sql(
+        text(query_cube_counts), engine, params={"last_id": cube["last_id"], "max_id": int(state["max_id"])}
+    )
+    cube = add_counts(cube, counts_df)
+    cube.update(last_id=int(state["max_id"]), n=int(state["n"]), id_sum=int(state["id_sum"]), checksum=int(state["checksum"]))
+    save_cube(cube, path)
+    print(f"Day-of-year cube updated with {int(counts_df['count'].sum())} tweets.")
+    return cube
+
+# Selected years, all years by default
+def year_slice(cube, years=None):
+    if years is None:
+        return cube["counts"]
+    return cube["counts"][:, [cube["years"].index(year) for year in years if year in cube["years"]]]
+
+# Counts per day of year (1 to 366) of all relevant tweets
+def all_day_counts(cube, years=None):
+    return pd.Series(year_slice(cube, years).sum(axis=(0, 1)), index=pd.RangeIndex(1, 367, name="day_of_year"), name="count")
+
+# Counts per term and day of year, terms without tweets are dropped
+def term_day_counts(cube, terms=None, years=None):
+    counts = pd.DataFrame(
+        year_slice(cube, years).sum(axis=1),
+        index=pd.Index(cube["terms"], name="term"),
+        columns=pd.RangeIndex(1, 367, name="day_of_year"),
+    )
+    if terms is not None:
+        counts = counts[counts.index.isin(terms)]
+    return counts[counts.sum(axis=1) > 0]
@@ -0,0 +1,124 @@
+# Convert the raw tweet dumps to Parquet, step 0
+# The store is partitioned by year and month and can be read by 1_filtering.py
+import os
+import re
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Columns kept from the dumps
+REQUIRED_COLUMNS = ['text', 'created_at', 'user_location', 'place_full_name', 'geo_latitude', 'geo_longitude']
+COLUMN_DTYPES = {
+    'text': str,
+    'created_at': str,
+    'user_location': str,
+    'place_full_name': str,
+    'geo_latitude': str,
+    'geo_longitude': str,
+}
+CHUNK_SIZE = 500000
+
+# Parquet schema, locations are dictionary-encoded since they repeat a lot
+PARQUET_SCHEMA = pa.schema([
+    ('text', pa.string()),
+    ('created_at', pa.timestamp('us')),
+    ('user_location', pa.dictionary(pa.int32(), pa.string())),
+    ('place_full_name', pa.dictionary(pa.int32(), pa.string())),
+    ('geo_latitude', pa.float64()),
+    ('geo_longitude', pa.float64()),
+    ('year', pa.int16()),
+    ('month', pa.int8()),
+])
+
+# Typed columns and partition keys for one chunk
+def prepare_chunk(df):
+    # Timestamps are stored in UTC without time zone, like the TIMESTAMP column in the database
+    created_at = pd.to_datetime(df['created_at'], errors='coerce', utc=True).dt.tz_convert(None)
+    return pd.DataFrame({
+        'text': df['text'],
+        'created_at': created_at,
+        'user_location': df['user_location'].astype('category'),
+        'place_full_name': df['place_full_name'].astype('category'),
+        # Coordinates are read as text, so a malformed value only loses that value and not the file
+        'geo_latitude': pd.to_numeric(df['geo_latitude'], errors='coerce'),
+        'geo_longitude': pd.to_numeric(df['geo_longitude'], errors='coerce'),
+        'year': created_at.dt.year.astype('Int16'),
+        'month': created_at.dt.month.astype('Int8'),
+    })
+
+# Name of the Parquet parts of a dump, from its path relative to the dump folder
+# so dumps with the same file name in different subfolders don't overwrite each other
+def part_stem(file_path, csv_directory):
+    relative_path = os.path.relpath(file_path, csv_directory)
+    return os.path.splitext(relative_path)[0].replace(os.sep, '__')
+
+# Remove the parts written by an earlier conversion of a dump
+# Otherwise parts of chunks the new conversion doesn't produce would remain as duplicate tweets
+def remove_existing_parts(parquet_directory, stem):
+    part_pattern = re.compile(rf"{re.escape(stem)}-\d+-\d+\.parquet")
+    removed = 0
+    for root, dirs, files in os.walk(parquet_directory):
+        for filename in files:
+            if part_pattern.fullmatch(filename):
+                os.remove(os.path.join(root, filename))
+                removed += 1
+    return removed
+
+# Convert one CSV
+# Returns the number of rows written
+def convert_csv_file(file_path, parquet_directory, chunk_size=CHUNK_SIZE, csv_directory=None):
+    try:
+        header = pd.read_csv(file_path, sep='\t', nrows=0).columns
+        if not all(col in header for col in REQUIRED_COLUMNS):
+            print(f"Skipping file {file_path} because it doesn't contain all required columns.")
+            return 0
+
+        file_stem = part_stem(file_path, csv_directory or os.path.dirname(file_path))
+        removed = remove_existing_parts(parquet_directory, file_stem)
+        if removed:
+            print(f"Removed {removed} Parquet parts of an earlier conversion of {file_path}.")
+        rows_written = 0
+        with pd.read_csv(file_path, sep='\t', on_bad_lines='skip', usecols=REQUIRED_COLUMNS, dtype=COLUMN_DTYPES, chunksize=chunk_size) as reader:
+            for chunk_index, df in enumerate(reader):
+                table = pa.Table.from_pandas(prepare_chunk(df), schema=PARQUET_SCHEMA, preserve_index=False)
+                pq.write_to_dataset(
+                    table,
+                    parquet_directory,
+                    partition_cols=['year', 'month'],
+                    basename_template=f"{file_stem}-{chunk_index}-{{i}}.parquet",
+                    existing_data_behavior='overwrite_or_ignore',
+                    compression='zstd',
+                )
+                rows_written += len(df)
+        return rows_written
+    except Exception as e:
+        print(f"Error converting file {file_path}: {e}")
+        return 0
+
+# Convert all CSV files in the specified directory
+def convert_all_csv_files(csv_directory, parquet_directory, chunk_size=CHUNK_SIZE):
+    total_rows = 0
+    for root, dirs, files in os.walk(csv_directory):
+        for filename in sorted(files):
+            if filename.endswith('.csv'):
+                file_path = os.path.join(root, filename)
+                print(f"Converting file: {file_path}")
+                rows_written = convert_csv_file(file_path, parquet_directory, chunk_size, csv_directory)
+                total_rows += rows_written
+                print(f"File {file_path}: Rows written: {rows_written}")
+
+    print(f"Finished converting all files in {csv_directory} to {parquet_directory}. Total rows written: {total_rows}")
+
+# Main
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw tweet dumps to a Parquet store partitioned by year and month.")
+    parser.add_argument("csv_directory", help="Folder with the tab-separated dumps")
+    parser.add_argument("parquet_directory", help="Root folder of the Parquet store")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of CSV rows converted at once")
+    args = parser.parse_args()
+
+    convert_all_csv_files(args.csv_directory, args.parquet_directory, args.chunk_size)
+
+if __name__ == "__main__":
+    main()
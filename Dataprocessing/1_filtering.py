@@ -1,6 +1,15 @@
 # File for Filtering the Tweets
 import os
+import io
+import hashlib
+import argparse
+import random
+import time
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import psycopg2
 import re
 
@@ -16,13 +25,15 @@ def connect_to_db():
         return conn, cursor
     
 # Create Table
-def create_filtered_tweets_table(cursor):
-    cursor.execute("""
-        DROP TABLE IF EXISTS variance.filtered_tweets;
-       """)
+# With reset=False existing data is kept and only missing tables/columns are added
+def create_filtered_tweets_table(cursor, reset=True):
+    if reset:
+        cursor.execute("""
+            DROP TABLE IF EXISTS variance.filtered_tweets;
+           """)
     
     cursor.execute("""
-        CREATE TABLE variance.filtered_tweets (
+        CREATE TABLE IF NOT EXISTS variance.filtered_tweets (
             id SERIAL PRIMARY KEY,
             tweet_text TEXT NOT NULL,
             found_term TEXT,
@@ -30,11 +41,115 @@ def create_filtered_tweets_table(cursor):
             user_location TEXT,    
             place_full_name TEXT, 
             geo_latitude DOUBLE PRECISION,  
-            geo_longitude DOUBLE PRECISION  
+            geo_longitude DOUBLE PRECISION,
+            source_file TEXT
         );
     """)
+    cursor.execute("ALTER TABLE variance.filtered_tweets ADD COLUMN IF NOT EXISTS source_file TEXT;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS filtered_tweets_source_file_idx ON variance.filtered_tweets (source_file);")
     cursor.connection.commit()
 
+# Create Manifest Table
+# One row per processed file, used to skip unchanged files in incremental runs
+# terms_hash identifies the term list the file was filtered with
+def create_manifest_table(cursor, reset=True):
+    if reset:
+        cursor.execute("DROP TABLE IF EXISTS variance.filtered_files;")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS variance.filtered_files (
+            file_path TEXT PRIMARY KEY,
+            file_size BIGINT,
+            file_mtime DOUBLE PRECISION,
+            file_hash TEXT,
+            terms_hash TEXT,
+            tweets_before_filtering BIGINT,
+            tweets_processed BIGINT,
+            terms_saved BIGINT,
+            processed_at TIMESTAMP DEFAULT now()
+        );
+    """)
+    cursor.execute("ALTER TABLE variance.filtered_files ADD COLUMN IF NOT EXISTS terms_hash TEXT;")
+    cursor.connection.commit()
+
+# Load Manifest
+def load_manifest(cursor):
+    cursor.execute("SELECT file_path, file_size, file_mtime, file_hash, terms_hash FROM variance.filtered_files;")
+    return {row[0]: (row[1], row[2], row[3], row[4]) for row in cursor.fetchall()}
+
+# File size and modification time
+def file_stat(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+# File content hash
+def hash_file(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+# Select files that are new or changed since they were recorded in the manifest
+# Files filtered with another term list are processed again. Files with a new mtime
+# but the same content are only updated in the manifest.
+# Returns {file_path: file_hash}, the hash is None for files that weren't hashed yet
+def select_changed_files(file_paths, manifest, cursor, terms_hash):
+    changed_files = {}
+    for file_path in file_paths:
+        file_size, file_mtime = file_stat(file_path)
+        known = manifest.get(file_path)
+        if known and known[3] != terms_hash:
+            changed_files[file_path] = None
+            continue
+        if known and known[:2] == (file_size, file_mtime):
+            continue
+        file_hash = None
+        if known and known[2] is not None:
+            file_hash = hash_file(file_path)
+            if known[2] == file_hash:
+                cursor.execute(
+                    "UPDATE variance.filtered_files SET file_size = %s, file_mtime = %s WHERE file_path = %s;",
+                    (file_size, file_mtime, file_path)
+                )
+                continue
+        changed_files[file_path] = file_hash
+    cursor.connection.commit()
+    return changed_files
+
+# Remove the rows of files in the manifest that no longer exist below the input folder
+# e.g. Parquet parts replaced when a dump is staged again
+def remove_deleted_files(csv_directory, manifest, cursor):
+    prefix = os.path.join(os.path.abspath(csv_directory), '')
+    deleted_files = [file_path for file_path in manifest if file_path.startswith(prefix) and not os.path.exists(file_path)]
+    for file_path in deleted_files:
+        cursor.execute("DELETE FROM variance.filtered_tweets WHERE source_file = %s;", (file_path,))
+        cursor.execute("DELETE FROM variance.filtered_files WHERE file_path = %s;", (file_path,))
+    cursor.connection.commit()
+    return len(deleted_files)
+
+# Rows from before the manifest have no source file, an incremental run could never replace them
+def has_untracked_rows(cursor):
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM variance.filtered_tweets WHERE source_file IS NULL);")
+    return cursor.fetchone()[0]
+
+# Record a processed file in the manifest
+def record_processed_file(cursor, file_path, file_size, file_mtime, file_hash, terms_hash, counts):
+    cursor.execute("""
+        INSERT INTO variance.filtered_files
+            (file_path, file_size, file_mtime, file_hash, terms_hash, tweets_before_filtering, tweets_processed, terms_saved, processed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, now())
+        ON CONFLICT (file_path) DO UPDATE SET
+            file_size = EXCLUDED.file_size,
+            file_mtime = EXCLUDED.file_mtime,
+            file_hash = EXCLUDED.file_hash,
+            terms_hash = EXCLUDED.terms_hash,
+            tweets_before_filtering = EXCLUDED.tweets_before_filtering,
+            tweets_processed = EXCLUDED.tweets_processed,
+            terms_saved = EXCLUDED.terms_saved,
+            processed_at = EXCLUDED.processed_at;
+    """, (file_path, file_size, file_mtime, file_hash, terms_hash, *counts))
+
 # Get Terms
 def fetch_landscape_terms(cursor):
     try:
@@ -55,91 +170,425 @@ def fetch_landscape_terms(cursor):
 def tokenize(text):
     return re.findall(r'\b\w+\b', text.lower())
 
+# Compile Terms into a matcher
+# Single-word terms go into a dict (term -> position in the term list) for set-style lookups,
+# multi-word terms into a token trie that is walked once over the tweet tokens.
+def compile_term_matcher(landscape_terms):
+    single_terms = {}
+    phrase_trie = {}
+    for order, term in enumerate(dict.fromkeys(landscape_terms)):
+        term_tokens = tokenize(term)
+        if not term_tokens:
+            continue
+        if len(term_tokens) == 1:
+            single_terms.setdefault(term_tokens[0], (order, term))
+            continue
+        node = phrase_trie
+        for token in term_tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(None, (order, term))
+    return single_terms, phrase_trie
+
+# Match Terms
+# Returns all terms found in the tokens, in the order of the term list
+def match_terms(tokens, matcher):
+    single_terms, phrase_trie = matcher
+    token_set = set(tokens)
+    hits = {single_terms[token] for token in token_set.intersection(single_terms)}
+    if phrase_trie and not token_set.isdisjoint(phrase_trie):
+        for start, first_token in enumerate(tokens):
+            node = phrase_trie.get(first_token)
+            if node is None:
+                continue
+            for token in tokens[start + 1:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                if None in node:
+                    hits.add(node[None])
+    return [term for order, term in sorted(hits)]
+
+# Walk the phrase trie, yields (phrase tokens, (order, term))
+def iter_phrases(phrase_trie, prefix=()):
+    for token, node in phrase_trie.items():
+        if token is None:
+            yield prefix, node
+        else:
+            yield from iter_phrases(node, prefix + (token,))
+
+# Hash of the terms of a matcher and their order, which decide the found_term rows of a file
+def matcher_hash(matcher):
+    single_terms, phrase_trie = matcher
+    terms = sorted(list(single_terms.values()) + [entry for phrase_tokens, entry in iter_phrases(phrase_trie)])
+    return hashlib.sha256(repr(terms).encode()).hexdigest()
+
 # Insert Data
-def insert_single_entry(cursor, entry):
+# Entries are written in batches with COPY. Each batch runs in its own savepoint, a failing
+# batch is retried row by row, so only the rows the database rejects are skipped.
+ENTRY_COLUMNS = ['tweet_text', 'found_term', 'created_at', 'user_location', 'place_full_name', 'geo_latitude', 'geo_longitude']
+BATCH_SIZE = 10000
+
+def copy_entries(cursor, entries, source_file):
+    buffer = io.StringIO()
+    entries.assign(source_file=source_file).to_csv(buffer, columns=ENTRY_COLUMNS + ['source_file'], index=False, header=False)
+    buffer.seek(0)
+    copy_query = f"""
+        COPY variance.filtered_tweets ({', '.join(ENTRY_COLUMNS)}, source_file)
+        FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (tweet_text, found_term, user_location, place_full_name))
+    """
+    cursor.execute("SAVEPOINT insert_batch;")
     try:
-        insert_query = """
-            INSERT INTO variance.filtered_tweets (tweet_text, found_term, created_at, user_location, place_full_name, geo_latitude, geo_longitude)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(insert_query, entry)
-        cursor.connection.commit()
+        cursor.copy_expert(copy_query, buffer)
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT insert_batch;")
+        raise
+    cursor.execute("RELEASE SAVEPOINT insert_batch;")
+
+# Returns the number of entries saved
+def insert_entries(cursor, entries, source_file):
+    try:
+        copy_entries(cursor, entries, source_file)
+        return len(entries)
     except Exception as e:
-        print(f"Error inserting entry: {e}")
+        print(f"Error inserting batch of {len(entries)} entries, retrying row by row: {e}")
+
+    saved = 0
+    for position in range(len(entries)):
+        try:
+            copy_entries(cursor, entries.iloc[position:position + 1], source_file)
+            saved += 1
+        except Exception as e:
+            print(f"Skipping entry {entries['tweet_text'].iloc[position][:50]!r}: {e}")
+    return saved
+
+# Filter Tweets row by row
+def filter_tweets_rows(df, matcher):
+    entries = []
+    for index, row in df.iterrows():
+        tweet_text = str(row['text']).lower()
+        if tweet_text.startswith("rt "):  # Skip retweets
+            continue
+
+        created_at = row['created_at'] if not pd.isna(row['created_at']) else None
+        user_location = str(row['user_location']) if not pd.isna(row['user_location']) else 'unknown'
+        place_full_name = str(row['place_full_name']) if not pd.isna(row['place_full_name']) else 'unknown'
+        geo_latitude = row['geo_latitude'] if not pd.isna(row['geo_latitude']) else None
+        geo_longitude = row['geo_longitude'] if not pd.isna(row['geo_longitude']) else None
+
+        tokens = tokenize(tweet_text)
+
+        for term in match_terms(tokens, matcher):
+            entries.append((tweet_text, term, created_at, user_location, place_full_name, geo_latitude, geo_longitude))
+    return entries
+
+# Filter Tweets column-wise
+# Same entries as filter_tweets_rows, but with vectorized string operations over the whole frame
+def filter_tweets_columnar(df, matcher):
+    single_terms, phrase_trie = matcher
+
+    # Tweets without text can't contain a term
+    df = df[df['text'].notna()]
+    tweet_text = df['text'].astype(str).str.lower()
+    is_retweet = tweet_text.str.startswith("rt ")
+    df, tweet_text = df[~is_retweet], tweet_text[~is_retweet]
+
+    tweets = pd.DataFrame({
+        'tweet_text': tweet_text,
+        'created_at': df['created_at'].astype(object).where(df['created_at'].notna(), None),
+        'user_location': df['user_location'].astype(str).where(df['user_location'].notna(), 'unknown'),
+        'place_full_name': df['place_full_name'].astype(str).where(df['place_full_name'].notna(), 'unknown'),
+        'geo_latitude': df['geo_latitude'].astype(object).where(df['geo_latitude'].notna(), None),
+        'geo_longitude': df['geo_longitude'].astype(object).where(df['geo_longitude'].notna(), None),
+    }).reset_index(drop=True)
+
+    # Single-word terms: explode tokens and keep the ones in the term set
+    tokens = tweets['tweet_text'].str.findall(r'\b\w+\b').explode()
+    tokens = tokens[tokens.isin(single_terms.keys())]
+    hits = [pd.DataFrame({
+        'order': tokens.map({token: order for token, (order, term) in single_terms.items()}),
+        'found_term': tokens.map({token: term for token, (order, term) in single_terms.items()}),
+    })]
+
+    # Multi-word terms: consecutive tokens are separated by non-word characters
+    for phrase_tokens, (order, term) in iter_phrases(phrase_trie):
+        pattern = r'(?<!\w)' + r'\W+'.join(re.escape(token) for token in phrase_tokens) + r'(?!\w)'
+        found = tweets.index[tweets['tweet_text'].str.contains(pattern, regex=True)]
+        hits.append(pd.DataFrame({'order': order, 'found_term': term}, index=found))
+
+    hits = pd.concat(hits).rename_axis('row').reset_index()
+    hits = hits.drop_duplicates(['row', 'order']).sort_values(['row', 'order'])
+
+    entries = tweets.loc[hits['row']].reset_index(drop=True)
+    entries.insert(1, 'found_term', hits['found_term'].to_numpy())
+    return entries
+
+# Columns read from the CSV's
+REQUIRED_COLUMNS = ['text', 'created_at', 'user_location', 'place_full_name', 'geo_latitude', 'geo_longitude']
+COLUMN_DTYPES = {
+    'text': str,
+    'created_at': str,
+    'user_location': str,
+    'place_full_name': str,
+    'geo_latitude': str,
+    'geo_longitude': str,
+}
+# Coordinates and timestamps are read as text and converted per chunk, so a malformed value only loses that value
+NUMERIC_COLUMNS = ['geo_latitude', 'geo_longitude']
+CHUNK_SIZE = 100000
+
+# Read CSV in chunks, yields (rows read, chunk)
+# Returns None if the file doesn't contain all required columns
+def read_csv_chunks(file_path, chunk_size=CHUNK_SIZE):
+    header = pd.read_csv(file_path, sep='\t', nrows=0).columns
+    if not all(col in header for col in REQUIRED_COLUMNS):
+        return None
+    reader = pd.read_csv(
+        file_path, sep='\t', on_bad_lines='skip',
+        usecols=REQUIRED_COLUMNS, dtype=COLUMN_DTYPES, chunksize=chunk_size
+    )
+    return iter_csv_chunks(reader)
+
+def iter_csv_chunks(reader):
+    with reader:
+        for df in reader:
+            for col in NUMERIC_COLUMNS:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            # Stored in UTC without time zone, like the timestamps of the Parquet store (0_staging.py)
+            df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce', utc=True).dt.tz_convert(None)
+            yield len(df), df
+
+# Read Parquet in batches, yields (rows read, batch)
+# Only the required columns are decoded and retweets are dropped by the scanner
+# Returns None if the file doesn't contain all required columns
+def read_parquet_chunks(file_path, chunk_size=CHUNK_SIZE):
+    dataset = ds.dataset(file_path, format='parquet')
+    if not all(col in dataset.schema.names for col in REQUIRED_COLUMNS):
+        return None
+    return iter_parquet_chunks(dataset, chunk_size)
+
+def iter_parquet_chunks(dataset, chunk_size):
+    # Row count from the file metadata, so dropped retweets still count as read
+    rows_read = dataset.count_rows()
+    is_retweet = pc.starts_with(pc.utf8_lower(ds.field('text')), 'rt ')
+    for batch in dataset.to_batches(columns=REQUIRED_COLUMNS, filter=~is_retweet, batch_size=chunk_size):
+        yield rows_read, batch.to_pandas()
+        rows_read = 0
+    if rows_read:
+        yield rows_read, pd.DataFrame(columns=REQUIRED_COLUMNS)
+
+# Read a CSV dump or a Parquet file from the staging store (0_staging.py)
+def read_chunks(file_path, chunk_size=CHUNK_SIZE):
+    if file_path.endswith('.parquet'):
+        return read_parquet_chunks(file_path, chunk_size)
+    return read_csv_chunks(file_path, chunk_size)
 
 # Process CSV's
-def process_csv_file(file_path, landscape_terms, cursor):
+# All batches of a file are committed together with its manifest entry. Rows from an
+# earlier run of the same file are replaced.
+# Files are only hashed in incremental runs, a hash computed while selecting the file is passed in.
+def process_csv_file(file_path, matcher, cursor, columnar=True, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, incremental=False, file_hash=None):
     try:
-        df = pd.read_csv(file_path, sep='\t', on_bad_lines='skip')
-
-        required_columns = ['text', 'created_at', 'user_location', 'place_full_name', 'geo_latitude', 'geo_longitude']
-        if not all(col in df.columns for col in required_columns):
+        chunks = read_chunks(file_path, chunk_size)
+        if chunks is None:
             print(f"Skipping file {file_path} because it doesn't contain all required columns.")
             return 0, 0, 0
 
-        total_tweets_before_filtering = len(df)
+        file_size, file_mtime = file_stat(file_path)
+        if incremental and file_hash is None:
+            file_hash = hash_file(file_path)
+        cursor.execute("DELETE FROM variance.filtered_tweets WHERE source_file = %s;", (file_path,))
 
-        tweets_processed, terms_saved = 0, 0
-        for index, row in df.iterrows():
-            tweet_text = str(row['text']).lower()
-            if tweet_text.startswith("rt "):  # Skip retweets
-                continue
+        total_tweets_before_filtering, tweets_processed, terms_saved = 0, 0, 0
+        batch, batch_rows = [], 0
+        with closing(chunks):
+            for rows_read, df in chunks:
+                total_tweets_before_filtering += rows_read
 
-            created_at = row['created_at'] if not pd.isna(row['created_at']) else None
-            user_location = str(row['user_location']) if not pd.isna(row['user_location']) else 'unknown'
-            place_full_name = str(row['place_full_name']) if not pd.isna(row['place_full_name']) else 'unknown'
-            geo_latitude = row['geo_latitude'] if not pd.isna(row['geo_latitude']) else None
-            geo_longitude = row['geo_longitude'] if not pd.isna(row['geo_longitude']) else None
+                if columnar:
+                    entries = filter_tweets_columnar(df, matcher)
+                else:
+                    entries = pd.DataFrame(filter_tweets_rows(df, matcher), columns=ENTRY_COLUMNS)
 
-            tokens = tokenize(tweet_text)
+                tweets_processed += len(entries)
+                batch.append(entries)
+                batch_rows += len(entries)
+                if batch_rows >= batch_size:
+                    terms_saved += insert_entries(cursor, pd.concat(batch), file_path)
+                    batch, batch_rows = [], 0
 
-            for term in landscape_terms:
-                if term in tokens:
-                    tweets_processed += 1
-                    entry = (tweet_text, term, created_at, user_location, place_full_name, geo_latitude, geo_longitude)
-                    insert_single_entry(cursor, entry)
-                    terms_saved += 1
+        if batch_rows:
+            terms_saved += insert_entries(cursor, pd.concat(batch), file_path)
+        # Files with failed batches stay out of the manifest, so the next incremental run retries them
+        if terms_saved == tweets_processed:
+            counts = (total_tweets_before_filtering, tweets_processed, terms_saved)
+            record_processed_file(cursor, file_path, file_size, file_mtime, file_hash, matcher_hash(matcher), counts)
+        cursor.connection.commit()
 
         return total_tweets_before_filtering, tweets_processed, terms_saved
     except Exception as e:
+        cursor.connection.rollback()
         print(f"Error processing file {file_path}: {e}")
         return 0, 0, 0
 
+# Find CSV's and Parquet files, sorted so that logs and totals don't depend on the os.walk order
+# Paths are absolute, so the manifest and source_file match whatever form of the folder is passed
+def find_input_files(csv_directory):
+    file_paths = []
+    for root, dirs, files in os.walk(os.path.abspath(csv_directory)):
+        for filename in files:
+            if filename.endswith(('.csv', '.parquet')):
+                file_paths.append(os.path.join(root, filename))
+    return sorted(file_paths)
+
+# Worker setup: every worker process gets its own database connection
+worker_state = {}
+
+def init_worker(matcher, columnar, chunk_size, batch_size, incremental):
+    conn, cursor = connect_to_db()
+    worker_state.update(
+        conn=conn, cursor=cursor, matcher=matcher, columnar=columnar,
+        chunk_size=chunk_size, batch_size=batch_size, incremental=incremental
+    )
+
+def process_csv_file_in_worker(file_path, file_hash):
+    print(f"Processing file: {file_path}")
+    return process_csv_file(
+        file_path, worker_state['matcher'], worker_state['cursor'],
+        worker_state['columnar'], worker_state['chunk_size'], worker_state['batch_size'],
+        worker_state['incremental'], file_hash
+    )
+
+# Process files one after another, yields (file_path, counts)
+# file_hashes maps file paths to hashes that are already known
+def process_files_serially(file_paths, matcher, cursor, columnar, chunk_size, batch_size, incremental, file_hashes):
+    for file_path in file_paths:
+        print(f"Processing file: {file_path}")
+        yield file_path, process_csv_file(
+            file_path, matcher, cursor, columnar, chunk_size, batch_size, incremental, file_hashes.get(file_path)
+        )
+
+# Process files in a pool of worker processes, yields (file_path, counts) in file order
+def process_files_in_pool(file_paths, matcher, columnar, chunk_size, batch_size, workers, incremental, file_hashes):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(matcher, columnar, chunk_size, batch_size, incremental)) as executor:
+        futures = [executor.submit(process_csv_file_in_worker, file_path, file_hashes.get(file_path)) for file_path in file_paths]
+        for file_path, future in zip(file_paths, futures):
+            try:
+                yield file_path, future.result()
+            except Exception as e:
+                print(f"Error processing file {file_path} in worker: {e}")
+                yield file_path, (0, 0, 0)
+
 # Process all CSV files in the specified directory
-def process_all_csv_files(csv_directory, landscape_terms, cursor):
+# The directory can also be (a partition of) the Parquet store written by 0_staging.py
+# With incremental=True only files that are new or changed according to the manifest are processed
+def process_all_csv_files(csv_directory, matcher, cursor, columnar=True, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, workers=1, incremental=False):
     total_tweets_before_filtering = 0
     total_tweets_processed = 0
     total_terms_saved = 0
 
-    for root, dirs, files in os.walk(csv_directory):
-        for filename in files:
-            if filename.endswith('.csv'):
-                file_path = os.path.join(root, filename)
-                print(f"Processing file: {file_path}")
-                tweets_before_filtering, tweets_processed, terms_saved = process_csv_file(file_path, landscape_terms, cursor)
-                total_tweets_before_filtering += tweets_before_filtering
-                total_tweets_processed += tweets_processed
-                total_terms_saved += terms_saved
+    file_paths = find_input_files(csv_directory)
+    file_hashes = {}
+    if incremental:
+        if has_untracked_rows(cursor):
+            print("filtered_tweets contains rows without a source file from a run before the manifest. "
+                  "Run a full filtering without --incremental first.")
+            return
+        manifest = load_manifest(cursor)
+        deleted_files = remove_deleted_files(csv_directory, manifest, cursor)
+        if deleted_files:
+            print(f"Removed the rows of {deleted_files} files that no longer exist.")
+        file_hashes = select_changed_files(file_paths, manifest, cursor, matcher_hash(matcher))
+        print(f"Skipping {len(file_paths) - len(file_hashes)} unchanged files, {len(file_hashes)} files to process.")
+        file_paths = list(file_hashes)
+    if workers > 1:
+        results = process_files_in_pool(file_paths, matcher, columnar, chunk_size, batch_size, workers, incremental, file_hashes)
+    else:
+        results = process_files_serially(file_paths, matcher, cursor, columnar, chunk_size, batch_size, incremental, file_hashes)
 
-                print(f"File {file_path}: Total tweets before filtering: {tweets_before_filtering}, Tweets processed: {tweets_processed}, Terms saved: {terms_saved}")
+    for file_path, (tweets_before_filtering, tweets_processed, terms_saved) in results:
+        total_tweets_before_filtering += tweets_before_filtering
+        total_tweets_processed += tweets_processed
+        total_terms_saved += terms_saved
+
+        print(f"File {file_path}: Total tweets before filtering: {tweets_before_filtering}, Tweets processed: {tweets_processed}, Terms saved: {terms_saved}")
 
     print(f"Finished processing all files in {csv_directory}. Total tweets before filtering: {total_tweets_before_filtering}, Total tweets processed: {total_tweets_processed}, Total terms saved: {total_terms_saved}")
 
+# Benchmark
+# Compares the old per-term list scan with the compiled matcher on a synthetic corpus
+BENCHMARK_TERMS = [
+    "tierra", "mar", "playa", "río", "costa", "naturaleza", "cerro", "montaña",
+    "bosque", "lago", "desierto", "paisaje", "volcán", "colina", "amanecer",
+    "madrugada", "atardecer", "anochecer", "monte", "cumbre", "puesta de sol", "río abajo"
+]
+BENCHMARK_WORDS = [
+    "que", "de", "la", "el", "en", "y", "a", "los", "se", "del", "las", "un", "por", "con",
+    "no", "una", "su", "para", "es", "al", "lo", "como", "más", "pero", "sus", "hoy", "día",
+    "sol", "puesta", "abajo", "vida", "amor", "hermoso", "vista", "foto", "noche", "fin"
+]
+
+def benchmark_term_matching(n_terms=400, n_tweets=100000, seed=42):
+    rng = random.Random(seed)
+    # Pad the sample terms with synthetic words to the size of the real term and synonym list
+    landscape_terms = list(BENCHMARK_TERMS)
+    while len(landscape_terms) < n_terms:
+        landscape_terms.append("".join(rng.choices("abcdefghijklmnopqrstuvwxyzñáéíóú", k=rng.randint(4, 10))))
+    vocabulary = BENCHMARK_WORDS + [token for term in landscape_terms for token in tokenize(term)]
+    tweets = [" ".join(rng.choices(vocabulary, k=rng.randint(5, 30))) for _ in range(n_tweets)]
+    token_lists = [tokenize(tweet) for tweet in tweets]
+
+    start = time.perf_counter()
+    loop_hits = [[term for term in landscape_terms if term in tokens] for tokens in token_lists]
+    loop_seconds = time.perf_counter() - start
+
+    matcher = compile_term_matcher(landscape_terms)
+    start = time.perf_counter()
+    matcher_hits = [match_terms(tokens, matcher) for tokens in token_lists]
+    matcher_seconds = time.perf_counter() - start
+
+    # The list scan never finds multi-word terms, so compare on single-word terms only
+    single_terms = {term for order, term in matcher[0].values()}
+    mismatches = sum(
+        loop != [hit for hit in hits if hit in single_terms]
+        for loop, hits in zip(loop_hits, matcher_hits)
+    )
+    phrase_hits = sum(len(hits) - len(loop) for loop, hits in zip(loop_hits, matcher_hits))
+
+    print(f"Benchmark on {n_tweets} synthetic tweets and {len(landscape_terms)} terms:")
+    print(f"List scan: {loop_seconds:.3f}s, Compiled matcher: {matcher_seconds:.3f}s, Speedup: {loop_seconds / matcher_seconds:.1f}x")
+    print(f"Mismatches on single-word terms: {mismatches}, Additional multi-word hits: {phrase_hits}")
+
 # Main
 def main():
+    parser = argparse.ArgumentParser(description="Filter tweets by landscape terms.")
+    parser.add_argument("--directory", default='/Users/lippi/Library/Mobile Documents/com~apple~CloudDocs/04_Master/MasterThesis/Python/2017', help="Folder with CSV dumps or the Parquet store from 0_staging.py")
+    parser.add_argument("--mode", choices=["columnar", "rows"], default="columnar", help="Filter with vectorized column operations or row by row")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of CSV rows held in memory at once")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of matches written per COPY batch")
+    parser.add_argument("--workers", type=int, default=1, help="Number of files processed in parallel, each worker with its own database connection")
+    parser.add_argument("--incremental", action="store_true", help="Keep existing data and only process new or changed files")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the term matcher on a synthetic corpus and exit")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_term_matching()
+        return
+
     conn, cursor = connect_to_db()
     if not conn:
         return
 
-    create_filtered_tweets_table(cursor)
+    create_filtered_tweets_table(cursor, reset=not args.incremental)
+    create_manifest_table(cursor, reset=not args.incremental)
 
     landscape_terms = fetch_landscape_terms(cursor)
     if not landscape_terms:
         print("No landscape terms found.")
         return
+    matcher = compile_term_matcher(landscape_terms)
 
     # Process all CSV files in the folder '201'
-    process_all_csv_files('/Users/lippi/Library/Mobile Documents/com~apple~CloudDocs/04_Master/MasterThesis/Python/2017', landscape_terms, cursor)
+    process_all_csv_files(args.directory, matcher, cursor, args.mode == "columnar", args.chunk_size, args.batch_size, args.workers, args.incremental)
 
     cursor.close()
     conn.close()
@@ -1,11 +1,21 @@
 #machine learning, step 3
 
+import io
+import csv
+import hashlib
+import time
+import argparse
 import pandas as pd
 import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy import create_engine, text
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.metrics import precision_score, recall_score
+from sklearn.model_selection import RandomizedSearchCV, ParameterGrid, train_test_split
 
 # Database connection 
 DB_HOST = "localhost"
@@ -13,30 +23,68 @@ DB_NAME = "postgres"
 DB_USER = "postgres"
 DB_PASSWORD = "***********"
 DB_SCHEMA = "variance"
+CHUNK_SIZE = 50000
 
 # Connect DB
 def connect_to_db():
     return create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
 
-# Train model
-def train_model(engine, save_files=True):
-    query = f'SELECT "Tweet Text" AS tweet_text, "Label" FROM {DB_SCHEMA}.manual_labels'
-    labeled_data = pd.read_sql(text(query), engine)
-    
-    vectorizer = TfidfVectorizer()
-    X_train = vectorizer.fit_transform(labeled_data['tweet_text'].fillna(''))
-    y_train = labeled_data['Label']
-    
+# Feature pipeline
+# "tfidf" learns a vocabulary from the training data. "hashing" maps words to a fixed number
+# of features without a vocabulary, so it needs no fitting, its size doesn't grow with the
+# corpus and every worker produces the same features. IDF weighting on top is optional.
+# The Random Forest's training time grows with the number of columns, so the hashed space is
+# kept moderate; a few collisions don't matter for the size of the manual labels.
+N_HASH_FEATURES = 2 ** 16
+
+def build_vectorizer(features="tfidf", use_idf=True):
+    if features == "hashing":
+        hashing = HashingVectorizer(n_features=N_HASH_FEATURES, alternate_sign=False, norm=None if use_idf else "l2")
+        if not use_idf:
+            return hashing
+        return Pipeline([("hashing", hashing), ("tfidf", TfidfTransformer())])
+    return TfidfVectorizer()
+
+# Classifier and the parameters searched for it
+def build_classifier(classifier="random_forest"):
+    if classifier == "linear":
+        model = LogisticRegression(max_iter=1000)
+        param_dist = {
+            'C': [0.1, 1, 10, 100],
+            'class_weight': [None, 'balanced']
+        }
+        return model, param_dist
+
     model = RandomForestClassifier(random_state=42)
     param_dist = {
         'n_estimators': [100, 200, 300],
         'max_depth': [None, 10, 20],
         'min_samples_split': [2, 5]
     }
-    
-    grid_search = RandomizedSearchCV(model, param_distributions=param_dist, n_iter=10, cv=3, random_state=42, verbose=1)
-    grid_search.fit(X_train, y_train)
-    best_model = grid_search.best_estimator_
+    return model, param_dist
+
+# Fit vectorizer and classifier
+def fit_model(tweet_texts, labels, features="tfidf", classifier="random_forest", use_idf=True):
+    vectorizer = build_vectorizer(features, use_idf)
+    X_train = vectorizer.fit_transform(tweet_texts)
+
+    model, param_dist = build_classifier(classifier)
+    n_iter = min(10, len(ParameterGrid(param_dist)))
+    grid_search = RandomizedSearchCV(model, param_distributions=param_dist, n_iter=n_iter, cv=3, random_state=42, verbose=1)
+    grid_search.fit(X_train, labels)
+    return grid_search.best_estimator_, vectorizer
+
+# Load manually labeled tweets
+def load_labeled_data(engine):
+    query = f'SELECT "Tweet Text" AS tweet_text, "Label" FROM {DB_SCHEMA}.manual_labels'
+    return pd.read_sql(text(query), engine)
+
+# Train model
+# The file names are kept for every feature pipeline and classifier, so 5_precision.py and
+# the incremental labeling load whichever model was trained last
+def train_model(engine, save_files=True, features="tfidf", classifier="random_forest", use_idf=True):
+    labeled_data = load_labeled_data(engine)
+    best_model, vectorizer = fit_model(labeled_data['tweet_text'].fillna(''), labeled_data['Label'], features, classifier, use_idf)
     
     if save_files:
         pickle.dump(vectorizer, open("tfidf_vectorizer.pkl", "wb"))
@@ -44,6 +92,44 @@ def train_model(engine, save_files=True):
     
     return best_model, vectorizer
 
+# Compare feature pipelines
+# Precision on a held-out part of the manual labels, prediction throughput and pickle size
+PIPELINES = [
+    ("tfidf", "random_forest", True),
+    ("hashing", "random_forest", True),
+    ("hashing", "random_forest", False),
+    ("hashing", "linear", True),
+]
+
+def compare_feature_pipelines(engine):
+    labeled_data = load_labeled_data(engine)
+    X_train, X_test, y_train, y_test = train_test_split(
+        labeled_data['tweet_text'].fillna(''), labeled_data['Label'],
+        test_size=0.3, random_state=42, stratify=labeled_data['Label']
+    )
+
+    results = []
+    for features, classifier, use_idf in PIPELINES:
+        model, vectorizer = fit_model(X_train, y_train, features, classifier, use_idf)
+
+        start = time.perf_counter()
+        y_pred = model.predict(vectorizer.transform(X_test))
+        seconds = time.perf_counter() - start
+
+        results.append({
+            "Features": features,
+            "Classifier": classifier,
+            "IDF": use_idf,
+            "Precision": precision_score(y_test, y_pred),
+            "Recall": recall_score(y_test, y_pred),
+            "Tweets per second": len(X_test) / seconds,
+            "Pickle size (MB)": (len(pickle.dumps(model)) + len(pickle.dumps(vectorizer))) / 1e6,
+        })
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
+
 # Predict labels
 def predict_labels(engine, model, vectorizer):
     query = f'SELECT id, tweet_text FROM {DB_SCHEMA}.filtered_tweets'
@@ -58,11 +144,152 @@ def predict_labels(engine, model, vectorizer):
 def save_predictions(engine, predicted_data):
     predicted_data.to_sql("labeled_tweets", engine, schema=DB_SCHEMA, if_exists="replace", index=False)
 
+# Bulk insert for to_sql, writes the rows with COPY instead of INSERT statements
+def copy_insert(table, conn, keys, data_iter):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{key}"' for key in keys)
+    table_name = f'{table.schema}."{table.name}"' if table.schema else f'"{table.name}"'
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH CSV", buffer)
+
+# Load Model
+def load_model_and_vectorizer():
+    with open("best_random_forest_model.pkl", "rb") as model_file:
+        model = pickle.load(model_file)
+    with open("tfidf_vectorizer.pkl", "rb") as vec_file:
+        vectorizer = pickle.load(vec_file)
+    return model, vectorizer
+
+# Model version, a hash of the pickled model and vectorizer
+def model_version():
+    version = hashlib.sha256()
+    for path in ["best_random_forest_model.pkl", "tfidf_vectorizer.pkl"]:
+        with open(path, "rb") as f:
+            version.update(f.read())
+    return version.hexdigest()[:12]
+
+# Prepare labeled_tweets for incremental labeling
+# Labels from another model version are removed, so these tweets are predicted again.
+# Ids of filtered_tweets start over after a full filtering run, labels whose id now belongs
+# to a different tweet text are removed as well.
+def prepare_labeled_table(engine, version):
+    with engine.begin() as conn:
+        conn.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.labeled_tweets (
+                id BIGINT, tweet_text TEXT, "Label" BIGINT, model_version TEXT
+            )
+        '''))
+        conn.execute(text(f'ALTER TABLE {DB_SCHEMA}.labeled_tweets ADD COLUMN IF NOT EXISTS model_version TEXT'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS labeled_tweets_id_idx ON {DB_SCHEMA}.labeled_tweets (id)'))
+        deleted = conn.execute(
+            text(f'DELETE FROM {DB_SCHEMA}.labeled_tweets WHERE model_version IS DISTINCT FROM :version'),
+            {"version": version}
+        ).rowcount
+        stale = conn.execute(text(f'''
+            DELETE FROM {DB_SCHEMA}.labeled_tweets l
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {DB_SCHEMA}.filtered_tweets f
+                WHERE f.id = l.id AND f.tweet_text IS NOT DISTINCT FROM l.tweet_text
+            )
+        ''')).rowcount
+    print(f"Removed {deleted} labels from other model versions and {stale} labels of tweets that are no longer filtered.")
+
+# Worker setup: every worker process loads the pickled model once
+worker_state = {}
+
+def init_worker():
+    model, vectorizer = load_model_and_vectorizer()
+    model.set_params(n_jobs=1)
+    worker_state.update(model=model, vectorizer=vectorizer)
+
+def predict_in_worker(tweet_texts):
+    X_chunk = worker_state['vectorizer'].transform(tweet_texts)
+    return worker_state['model'].predict(X_chunk)
+
+# Predict chunks in a pool of worker processes, yields (chunk, predictions) in chunk order
+# Only a few chunks per worker are in flight, so memory stays bounded
+def predict_in_pool(chunks, workers):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(predict_in_worker, chunk['tweet_text'].fillna('').tolist())))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+# Predict and save labels chunk by chunk
+# filtered_tweets is read with a server-side cursor, so memory depends on the chunk size only.
+# With only_unlabeled=True, tweets already in labeled_tweets are skipped and new labels are appended.
+# The text is compared as well, since ids are reused after a full filtering run.
+def predict_and_save_in_chunks(engine, model, vectorizer, chunk_size=CHUNK_SIZE, version=None, only_unlabeled=False, workers=1):
+    where = ""
+    if only_unlabeled:
+        where = f" WHERE NOT EXISTS (SELECT 1 FROM {DB_SCHEMA}.labeled_tweets l WHERE l.id = f.id AND l.tweet_text IS NOT DISTINCT FROM f.tweet_text)"
+    with engine.connect() as conn:
+        total_rows = conn.execute(text(f'SELECT COUNT(*) FROM {DB_SCHEMA}.filtered_tweets f{where}')).scalar()
+
+    query = f'SELECT f.id, f.tweet_text FROM {DB_SCHEMA}.filtered_tweets f{where}'
+    labeled_rows = 0
+    with engine.connect().execution_options(stream_results=True) as conn:
+        chunks = pd.read_sql(text(query), conn, chunksize=chunk_size)
+        if workers > 1:
+            predicted_chunks = predict_in_pool(chunks, workers)
+        else:
+            predicted_chunks = ((chunk, model.predict(vectorizer.transform(chunk['tweet_text'].fillna('')))) for chunk in chunks)
+
+        for chunk, predictions in predicted_chunks:
+            chunk['Label'] = predictions
+            if version is not None:
+                chunk['model_version'] = version
+
+            # The first chunk replaces the old table, the others are appended
+            if_exists = "replace" if labeled_rows == 0 and not only_unlabeled else "append"
+            chunk.to_sql("labeled_tweets", engine, schema=DB_SCHEMA, if_exists=if_exists, index=False, method=copy_insert)
+
+            labeled_rows += len(chunk)
+            print(f"Labeled {labeled_rows} of {total_rows} tweets.")
+
+# Label new tweets with the saved model
+# Time depends on the number of unlabeled tweets, not on the table size
+def label_new_tweets(engine, chunk_size=CHUNK_SIZE, workers=1, n_jobs=None):
+    model, vectorizer = load_model_and_vectorizer()
+    model.set_params(n_jobs=n_jobs)
+    version = model_version()
+    prepare_labeled_table(engine, version)
+    predict_and_save_in_chunks(engine, model, vectorizer, chunk_size, version, only_unlabeled=True, workers=workers)
+
 def main():
+    parser = argparse.ArgumentParser(description="Train the Random Forest and label the filtered tweets.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of tweets predicted at once")
+    parser.add_argument("--in-memory", action="store_true", help="Load and predict all tweets at once instead of streaming them")
+    parser.add_argument("--features", choices=["tfidf", "hashing"], default="tfidf", help="TF-IDF vocabulary or hashed features")
+    parser.add_argument("--classifier", choices=["random_forest", "linear"], default="random_forest", help="Random Forest or logistic regression")
+    parser.add_argument("--no-idf", action="store_true", help="Don't weight hashed features with IDF")
+    parser.add_argument("--compare", action="store_true", help="Compare the feature pipelines on the manual labels and exit")
+    parser.add_argument("--incremental", action="store_true", help="Skip training and only label tweets not yet labeled by the saved model")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes predicting chunks in parallel")
+    parser.add_argument("--n-jobs", type=int, default=None, help="n_jobs of the Random Forest when predicting in a single process")
+    args = parser.parse_args()
+
     engine = connect_to_db()
-    model, vectorizer = train_model(engine)
-    predicted_data = predict_labels(engine, model, vectorizer)
-    save_predictions(engine, predicted_data)
+    if args.compare:
+        compare_feature_pipelines(engine)
+    elif args.incremental:
+        label_new_tweets(engine, args.chunk_size, args.workers, args.n_jobs)
+    else:
+        model, vectorizer = train_model(engine, features=args.features, classifier=args.classifier, use_idf=not args.no_idf)
+        if args.in_memory:
+            predicted_data = predict_labels(engine, model, vectorizer)
+            save_predictions(engine, predicted_data)
+        else:
+            model.set_params(n_jobs=args.n_jobs)
+            predict_and_save_in_chunks(engine, model, vectorizer, args.chunk_size, model_version(), workers=args.workers)
     engine.dispose()
     print("Finished.")
 